@@ -75,6 +75,14 @@ class ULog(object):
     _unpack_ushort_byte = struct.Struct('<HB').unpack
     _unpack_ushort = struct.Struct('<H').unpack
     _unpack_uint64 = struct.Struct('<Q').unpack
+    _unpack_from_ushort = struct.Struct('<H').unpack_from
+    _unpack_from_uint64 = struct.Struct('<Q').unpack_from
+    _unpack_from_byte = struct.Struct('<B').unpack_from
+    _unpack_from_byte_ushort = struct.Struct('<BH').unpack_from
+    _unpack_from_byte_uint64 = struct.Struct('<BQ').unpack_from
+    _unpack_from_byte_ushort_uint64 = struct.Struct('<BHQ').unpack_from
+    _unpack_structs = {type_str: struct.Struct('<'+unpack_type[0])
+                       for type_str, unpack_type in _UNPACK_TYPES.items()}
 
     # when set to True disables string parsing exceptions
     _disable_str_exceptions = False
@@ -577,18 +585,17 @@ class ULog(object):
 
         def __init__(self, data, header, is_info_multiple=False):
             if is_info_multiple: # INFO_MULTIPLE message
-                self.is_continued, = struct.unpack('<B', data[0:1])
+                self.is_continued, = ULog._unpack_from_byte(data)
                 data = data[1:]
-            key_len, = struct.unpack('<B', data[0:1])
+            key_len, = ULog._unpack_from_byte(data)
             type_key = ULog.parse_string(data[1:1+key_len])
             type_key_split = type_key.split(' ')
             self.type = type_key_split[0]
             self.key = type_key_split[1]
             if self.type.startswith('char['): # it's a string
                 self.value = ULog.parse_string(data[1+key_len:])
-            elif self.type in ULog._UNPACK_TYPES:
-                unpack_type = ULog._UNPACK_TYPES[self.type]
-                self.value, = struct.unpack('<'+unpack_type[0], data[1+key_len:])
+            elif self.type in ULog._unpack_structs:
+                self.value, = ULog._unpack_structs[self.type].unpack(data[1+key_len:])
             else: # probably an array (or non-basic type)
                 self.value = data[1+key_len:]
 
@@ -596,7 +603,7 @@ class ULog(object):
         """ ULog parameter default message representation """
 
         def __init__(self, data, header):
-            self.default_types, = struct.unpack('<B', data[0:1])
+            self.default_types, = ULog._unpack_from_byte(data)
             msg_info = ULog._MessageInfo(data[1:], header)
             self.type = msg_info.type
             self.key = msg_info.key
@@ -655,8 +662,7 @@ class ULog(object):
         """ ULog logged string message representation """
 
         def __init__(self, data, header):
-            self.log_level, = struct.unpack('<B', data[0:1])
-            self.timestamp, = struct.unpack('<Q', data[1:9])
+            self.log_level, self.timestamp = ULog._unpack_from_byte_uint64(data)
             self.message = ULog.parse_string(data[9:])
 
         def __eq__(self, other):
@@ -681,9 +687,7 @@ class ULog(object):
         """ ULog tagged log string message representation """
 
         def __init__(self, data, header):
-            self.log_level, = struct.unpack('<B', data[0:1])
-            self.tag, = struct.unpack('<H', data[1:3])
-            self.timestamp, = struct.unpack('<Q', data[3:11])
+            self.log_level, self.tag, self.timestamp = ULog._unpack_from_byte_ushort_uint64(data)
             self.message = ULog.parse_string(data[11:])
 
         def __eq__(self, other):
@@ -708,7 +712,7 @@ class ULog(object):
     class MessageDropout(object):
         """ ULog dropout message representation """
         def __init__(self, data, header, timestamp):
-            self.duration, = struct.unpack('<H', data)
+            self.duration, = ULog._unpack_ushort(data)
             self.timestamp = timestamp
 
         def __eq__(self, other):
@@ -732,8 +736,7 @@ class ULog(object):
     class _MessageAddLogged(object):
         """ ULog add logging data message representation """
         def __init__(self, data, header, message_formats):
-            self.multi_id, = struct.unpack('<B', data[0:1])
-            self.msg_id, = struct.unpack('<H', data[1:3])
+            self.multi_id, self.msg_id = ULog._unpack_from_byte_ushort(data)
             self.message_name = ULog.parse_string(data[3:])
             self.field_data = [] # list of _FieldData
             self.timestamp_idx = -1
@@ -741,22 +744,22 @@ class ULog(object):
 
             self._parse_format(message_formats)
 
-            self.timestamp_offset = 0
-            for field in self.field_data:
-                if field.field_name == 'timestamp':
-                    break
-                self.timestamp_offset += ULog._UNPACK_TYPES[field.type_str][1]
-
             self.buffer = bytearray() # accumulate all message data here
 
             # construct types for numpy
             dtype_list = []
             for field in self.field_data:
-                numpy_type = ULog._UNPACK_TYPES[field.type_str][2]
-                self.max_data_size += ULog._UNPACK_TYPES[field.type_str][1]
+                _, field_size, numpy_type = ULog._UNPACK_TYPES[field.type_str]
+                self.max_data_size += field_size
                 dtype_list.append((field.field_name, numpy_type))
             self.dtype = np.dtype(dtype_list).newbyteorder('<')
 
+            # the packed dtype already knows the byte offset of each field
+            if 'timestamp' in self.dtype.fields:
+                self.timestamp_offset = self.dtype.fields['timestamp'][1]
+            else:
+                self.timestamp_offset = self.max_data_size
+
 
         def _parse_format(self, message_formats):
             self._parse_nested_type('', self.message_name, message_formats)
@@ -795,7 +798,7 @@ class ULog(object):
 
         def initialize(self, data, header, subscriptions, ulog_object) -> bool:
             has_corruption = False
-            msg_id, = ULog._unpack_ushort(data[:2])
+            msg_id, = ULog._unpack_from_ushort(data)
             if msg_id in subscriptions:
                 subscription = subscriptions[msg_id]
                 min_data_size = subscription.dtype.itemsize
@@ -805,14 +808,12 @@ class ULog(object):
                     self.timestamp = 0
                     has_corruption = True
                 else:
-                    if data_size > min_data_size:
-                        # Strip extra data (_padding bytes)
-                        data = data[:2+min_data_size]
-                    # accumulate data to a buffer, will be parsed later
-                    subscription.buffer += data[2:]
+                    # accumulate data to a buffer, will be parsed later. Extra
+                    # data (_padding bytes) is stripped by the same slice.
+                    subscription.buffer += data[2:2+min_data_size]
                     t_off = subscription.timestamp_offset
                     # TODO: the timestamp can have another size than uint64
-                    self.timestamp, = ULog._unpack_uint64(data[t_off+2:t_off+10])
+                    self.timestamp, = ULog._unpack_from_uint64(data, t_off+2)
             else:
                 if not msg_id in ulog_object._filtered_message_ids:
                     # this is an error, but make it non-fatal
@@ -1038,11 +1039,15 @@ class ULog(object):
 
             curr_file_pos = self._file_handle.tell()
 
+            # local names for what is looked up on every message
+            read = self._file_handle.read
+            msg_type_data = self.MSG_TYPE_DATA
+
             while True:
-                data = self._file_handle.read(3)
+                data = read(3)
                 curr_file_pos += len(data)
                 header.initialize(data)
-                data = self._file_handle.read(header.msg_size)
+                data = read(header.msg_size)
                 curr_file_pos += len(data)
                 if len(data) < header.msg_size:
                     break # less data than expected. File is most likely cut
@@ -1054,7 +1059,15 @@ class ULog(object):
                     break
 
                 try:
-                    if header.msg_type == self.MSG_TYPE_INFO:
+                    # data messages are by far the most common, so check them first
+                    if header.msg_type == msg_type_data:
+                        has_corruption = msg_data.initialize(data, header, self._subscriptions,
+                                                             self)
+                        if has_corruption:
+                            self._file_corrupt = True
+                        elif msg_data.timestamp > self._last_timestamp:
+                            self._last_timestamp = msg_data.timestamp
+                    elif header.msg_type == self.MSG_TYPE_INFO:
                         msg_info = self._MessageInfo(data, header)
                         self._msg_info_dict[msg_info.key] = msg_info.value
                         self._msg_info_dict_types[msg_info.key] = msg_info.type
@@ -1085,13 +1098,6 @@ class ULog(object):
                             self._logged_messages_tagged[msg_log_tagged.tag].append(msg_log_tagged)
                         else:
                             self._logged_messages_tagged[msg_log_tagged.tag] = [msg_log_tagged]
-                    elif header.msg_type == self.MSG_TYPE_DATA:
-                        has_corruption = msg_data.initialize(data, header, self._subscriptions,
-                                                             self)
-                        if has_corruption:
-                            self._file_corrupt = True
-                        elif msg_data.timestamp > self._last_timestamp:
-                            self._last_timestamp = msg_data.timestamp
                     elif header.msg_type == self.MSG_TYPE_DROPOUT:
                         msg_dropout = self.MessageDropout(data, header,
                                                           self._last_timestamp)
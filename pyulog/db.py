@@ -2,12 +2,22 @@
 Module containing the DatabaseULog class.
 '''
 
+import os
+import mmap
 import sqlite3
+import threading
 import hashlib
+import operator
 import contextlib
+import concurrent.futures
 import numpy as np
 from pyulog import ULog
 
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
 # pylint: disable=too-many-instance-attributes
 class DatabaseULog(ULog):
     '''
@@ -49,22 +59,64 @@ class DatabaseULog(ULog):
     contsructor will throw an exception. See the documentation of
     "ulog_migratedb" for more information.
     '''
-    SCHEMA_VERSION = 5
+    SCHEMA_VERSION = 7
+
+    # numpy dtypes of the ULog field types, so that they are not looked up
+    # and constructed again for every field that is read.
+    _NP_DTYPES = {
+        type_str: np.dtype(unpack_type[2])
+        for type_str, unpack_type in ULog._UNPACK_TYPES.items()
+    }
 
     @staticmethod
     def get_db_handle(db_path):
         '''
         Generate a database handle that can be used in subsequent database access.
+
+        The handle opens one connection per thread on first use, and returns
+        that same connection on later calls, so that repeated small operations
+        don't pay for connecting each time. Since the connection is shared by
+        all users of the handle in a thread, it should not be closed, and any
+        pending writes on it are committed by the next "with db_handle()"
+        block, including those inside DatabaseULog. If the connection has been
+        closed anyway, a new one is opened on the next call.
+
+        Call db_handle.close() to release the connection of the calling thread,
+        e.g. before removing the database file. The next call opens a new one.
         '''
+        local = threading.local()
+
         def db_handle():
+            con = getattr(local, 'con', None)
+            if con is not None:
+                try:
+                    con.in_transaction # pylint: disable=pointless-statement
+                    return con
+                except sqlite3.ProgrammingError:
+                    pass
             con = sqlite3.connect(
                 db_path,
-                detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES
+                detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+                cached_statements=512,
             )
             # The next line is necessary for sqlite3 to actually respect
             # FOREIGN KEY constraints and ON DELETE CASCADE.
             con.execute('PRAGMA foreign_keys=on')
+            # Larger page cache and memory-mapped I/O for the bulk reads and
+            # writes of dataset BLOBs. These only apply to this connection.
+            con.execute('PRAGMA temp_store=MEMORY')
+            con.execute('PRAGMA cache_size=-65536')
+            con.execute('PRAGMA mmap_size=268435456')
+            local.con = con
             return con
+
+        def close():
+            con = getattr(local, 'con', None)
+            if con is not None:
+                con.close()
+                local.con = None
+
+        db_handle.close = close
         return db_handle
 
     @staticmethod
@@ -110,23 +162,42 @@ class DatabaseULog(ULog):
     def calc_sha256sum(log_file):
         '''
         Compute the SHA256 digest of a file, specified as a file or a valid file path.
+
+        File paths and closed files are hashed in full. Open files are hashed
+        from their current position to the end.
         '''
         if log_file is None:
             return None
         if isinstance(log_file, str):
-            file_context = open(log_file, 'rb') # pylint: disable=consider-using-with
+            file_path = log_file
         elif log_file.closed:
-            file_context = open(log_file.name, 'rb')
+            file_path = log_file.name
         else:
-            file_context = contextlib.nullcontext(log_file)
-
+            file_path = None
+
+        if file_path is not None:
+            # Hash the whole file as a single memoryview over a mmap, which
+            # avoids allocating and copying a bytes object per block.
+            file_hash = hashlib.sha256()
+            with open(file_path, 'rb') as open_file:
+                if os.fstat(open_file.fileno()).st_size > 0:
+                    with mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        with memoryview(mapped) as view:
+                            file_hash.update(view)
+            return file_hash.hexdigest()
+
+        if (hasattr(hashlib, 'file_digest')
+                and hasattr(log_file, 'readinto')
+                and hasattr(log_file, 'readable')
+                and not hasattr(log_file, 'getbuffer')):
+            # Python >= 3.11 hashes the file in C with a large buffer. It
+            # needs readinto() and readable(), and it hashes the whole buffer
+            # of BytesIO-like objects regardless of their position, so other
+            # objects use the read loop below, which only needs read().
+            return hashlib.file_digest(log_file, 'sha256').hexdigest()
         file_hash = hashlib.sha256()
-        with file_context as open_file:
-            while True:
-                block = open_file.read(4096)
-                file_hash.update(block)
-                if block == b'':
-                    break
+        while block := log_file.read(1 << 20):
+            file_hash.update(block)
         return file_hash.hexdigest()
 
 
@@ -172,10 +243,19 @@ class DatabaseULog(ULog):
         self._pk = primary_key
         self._db = db_handle
         self._lazy_loaded = lazy
-        if log_file is not None:
-            self._sha256sum = DatabaseULog.calc_sha256sum(log_file)
+        if log_file is not None and (isinstance(log_file, str) or log_file.closed):
+            # Hashing opens its own file handle and releases the GIL, so it can
+            # run while the file is being parsed.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                sha256sum_future = executor.submit(DatabaseULog.calc_sha256sum, log_file)
+                super().__init__(log_file, **kwargs)
+                self._sha256sum = sha256sum_future.result()
+        else:
+            if log_file is not None:
+                self._sha256sum = DatabaseULog.calc_sha256sum(log_file)
+            super().__init__(log_file, **kwargs)
 
-        super().__init__(log_file, **kwargs)
+        self._index_data_list()
         if primary_key is not None:
             self.load(lazy=lazy)
 
@@ -217,9 +297,6 @@ class DatabaseULog(ULog):
         Even if the log was originally saved with append_json=True, this
         function will always use the faster BLOB column for retrieval.
         '''
-        if not DatabaseULog.exists_in_db(self._db, self._pk):
-            raise KeyError(f'No ULog in database with Id={self._pk}')
-
         with self._db() as con:
             cur = con.cursor()
 
@@ -237,11 +314,13 @@ class DatabaseULog(ULog):
                 WHERE Id = ?
                 ''', (self._pk,))
             ulog_result = cur.fetchone()
+            if ulog_result is None:
+                raise KeyError(f'No ULog in database with Id={self._pk}')
             self._file_version = ulog_result[0]
             self._start_timestamp = ulog_result[1]
             self._last_timestamp = ulog_result[2]
-            self._compat_flags = [ord(c) for c in ulog_result[3]]
-            self._incompat_flags = [ord(c) for c in ulog_result[4]]
+            self._compat_flags = DatabaseULog._parse_flags(ulog_result[3])
+            self._incompat_flags = DatabaseULog._parse_flags(ulog_result[4])
             self._sync_seq_cnt = ulog_result[5]
             self._has_sync = ulog_result[6]
             self._sha256sum = ulog_result[7]
@@ -253,26 +332,52 @@ class DatabaseULog(ULog):
                 WHERE ULogId = ?
                 ORDER BY SeriesIndex
                 ''', (self._pk,))
-            offsets_result = cur.fetchall()
-            for offset, in offsets_result:
+            for offset, in cur:
                 self._appended_offsets.append(offset)
 
             # data_list
+            fields_by_dataset = {}
+            if not lazy:
+                # Fetch the fields of all datasets at once instead of calling
+                # get_dataset for each of them.
+                cur.execute('''
+                    SELECT uf.DatasetId,
+                           uf.TopicName,
+                           uf.DataType,
+                           uf.ValueArray,
+                           uf.ValueArrayCompression,
+                           uf.QuantScheme,
+                           uf.QuantScale,
+                           uf.QuantOffset
+                    FROM ULogField uf JOIN ULogDataset uds
+                        ON uf.DatasetId = uds.Id
+                    WHERE uds.ULogId = ?
+                    ORDER BY uf.Id
+                    ''', (self._pk,))
+                for dataset_id, field_name, data_type, *value_array in cur:
+                    fields, data = fields_by_dataset.setdefault(dataset_id, ([], {}))
+                    fields.append(DatabaseULog._FieldData(field_name=field_name,
+                                                          type_str=data_type))
+                    data[field_name] = DatabaseULog._decode_value_array(data_type, *value_array)
+
             self._data_list = []
             cur.execute('''
-                SELECT DatasetName, MultiId
+                SELECT Id, DatasetName, MultiId, MessageId, TimestampIndex
                 FROM ULogDataset
                 WHERE ULogId = ?
                 ORDER BY DatasetName, MultiId
                 ''', (self._pk,))
-            dataset_results = cur.fetchall()
-            for dataset_name, multi_id in dataset_results:
-                dataset = self.get_dataset(dataset_name,
-                                           multi_instance=multi_id,
-                                           lazy=lazy,
-                                           db_cursor=cur,
-                                           caching=False)
-                self._data_list.append(dataset)
+            for dataset_id, dataset_name, multi_id, msg_id, timestamp_idx in cur:
+                fields, data = fields_by_dataset.get(dataset_id, ([], {}))
+                self._data_list.append(DatabaseULog.DatabaseData(
+                    name=dataset_name,
+                    multi_id=multi_id,
+                    msg_id=msg_id,
+                    timestamp_idx=timestamp_idx,
+                    field_data=fields,
+                    data=data,
+                ))
+            self._index_data_list()
 
             # dropouts
             cur.execute('''
@@ -280,7 +385,7 @@ class DatabaseULog(ULog):
                 FROM ULogMessageDropout
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for timestamp, duration in cur.fetchall():
+            for timestamp, duration in cur:
                 self._dropouts.append(
                     DatabaseULog.DatabaseMessageDropout(
                         timestamp=timestamp,
@@ -294,7 +399,7 @@ class DatabaseULog(ULog):
                 FROM ULogMessageLogging
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for log_level, timestamp, message in cur.fetchall():
+            for log_level, timestamp, message in cur:
                 self._logged_messages.append(
                     DatabaseULog.DatabaseMessageLogging(
                         log_level=log_level,
@@ -309,7 +414,7 @@ class DatabaseULog(ULog):
                 FROM ULogMessageLoggingTagged
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for log_level, tag, timestamp, message in cur.fetchall():
+            for log_level, tag, timestamp, message in cur:
                 if tag not in self._logged_messages_tagged:
                     self._logged_messages_tagged[tag] = []
                 self._logged_messages_tagged[tag].append(
@@ -332,7 +437,7 @@ class DatabaseULog(ULog):
                     ON field.MessageId = msg.Id
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for row in cur.fetchall():
+            for row in cur:
                 msg_name = row[0]
                 field_data = row[1:]
                 if msg_name in self._message_formats:
@@ -349,33 +454,35 @@ class DatabaseULog(ULog):
                 FROM ULogMessageInfo
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for key, typename, value in cur.fetchall():
+            for key, typename, value in cur:
                 self._msg_info_dict[key] = value
                 self._msg_info_dict_types[key] = typename
 
             # msg_info_multiple_dict
             cur.execute('''
-                SELECT Id, Key, Typename
-                FROM ULogMessageInfoMultiple
-                WHERE ULogId = ?
+                SELECT mim.Id, mim.Key, mim.Typename, miml.Id, mimle.Id, mimle.Value
+                FROM ULogMessageInfoMultiple mim
+                    LEFT JOIN ULogMessageInfoMultipleList miml
+                        ON miml.MessageId = mim.Id
+                    LEFT JOIN ULogMessageInfoMultipleListElement mimle
+                        ON mimle.ListId = miml.Id
+                WHERE mim.ULogId = ?
+                ORDER BY mim.Id, miml.SeriesIndex, mimle.SeriesIndex
                 ''', (self._pk,))
-            for message_id, key, typename in cur.fetchall():
-                self._msg_info_multiple_dict[key] = []
-                self._msg_info_multiple_dict_types[key] = typename
-                cur.execute('''
-                    SELECT Id
-                    FROM ULogMessageInfoMultipleList
-                    WHERE MessageId = ?
-                    ORDER BY SeriesIndex
-                    ''', (message_id,))
-                for (list_id,) in cur.fetchall():
-                    cur.execute('''
-                        SELECT Value
-                        FROM ULogMessageInfoMultipleListElement
-                        WHERE ListId = ?
-                        ORDER BY SeriesIndex
-                        ''', (list_id,))
-                    self._msg_info_multiple_dict[key].append([value for (value,) in cur.fetchall()])
+            previous_message_id = previous_list_id = None
+            for message_id, key, typename, list_id, element_id, value in cur:
+                if message_id != previous_message_id:
+                    self._msg_info_multiple_dict[key] = []
+                    self._msg_info_multiple_dict_types[key] = typename
+                    previous_message_id = message_id
+                    previous_list_id = None
+                if list_id is None:
+                    continue
+                if list_id != previous_list_id:
+                    self._msg_info_multiple_dict[key].append([])
+                    previous_list_id = list_id
+                if element_id is not None:
+                    self._msg_info_multiple_dict[key][-1].append(value)
 
             # initial_parameters
             cur.execute('''
@@ -383,7 +490,7 @@ class DatabaseULog(ULog):
                 FROM ULogInitialParameter
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for key, value in cur.fetchall():
+            for key, value in cur:
                 self._initial_parameters[key] = value
 
             # _default_parameters
@@ -392,7 +499,7 @@ class DatabaseULog(ULog):
                 FROM ULogDefaultParameter
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for default_type, key, value in cur.fetchall():
+            for default_type, key, value in cur:
                 if default_type not in self._default_parameters:
                     self._default_parameters[default_type] = {}
                 self._default_parameters[default_type][key] = value
@@ -403,12 +510,23 @@ class DatabaseULog(ULog):
                 FROM ULogChangedParameter
                 WHERE ULogId = ?
                 ''', (self._pk,))
-            for timestamp, key, value in cur.fetchall():
+            for timestamp, key, value in cur:
                 self._changed_parameters.append((timestamp, key, value))
 
             cur.close()
         self._lazy_loaded = lazy
 
+    def _index_data_list(self):
+        '''
+        Rebuild the lookup from (name, multi_id) to the datasets in
+        self._data_list, used by get_dataset. This must be called whenever
+        self._data_list is replaced. If there are duplicates, the first
+        dataset in the list is used.
+        '''
+        self._data_index = {}
+        for dataset in self._data_list:
+            self._data_index.setdefault((dataset.name, dataset.multi_id), dataset)
+
     def get_dataset(self, name, multi_instance=0, lazy=False, db_cursor=None, caching=True):
         '''
         Access a specific dataset and its data series from the database.
@@ -417,8 +535,8 @@ class DatabaseULog(ULog):
         retrieved from the database, or if the data series arrays should be
         retrieved too.
 
-        The optional "db_cursor" argument can be used to avoid re-opening the
-        database connection each time get_dataset is called.
+        The optional "db_cursor" argument can be used to reuse an existing
+        cursor, instead of creating a new one each time get_dataset is called.
 
         Since we don't expect the data to change often, we will normally use
         self._data_list as a cache, and check there before reading from the
@@ -433,11 +551,7 @@ class DatabaseULog(ULog):
             db_context = contextlib.nullcontext()
             cur = db_cursor
 
-        existing_dataset = None
-        for dataset in self._data_list:
-            if dataset.name == name and dataset.multi_id == multi_instance:
-                existing_dataset = dataset
-                break
+        existing_dataset = self._data_index.get((name, multi_instance))
 
         if (caching
                 and existing_dataset is not None
@@ -458,15 +572,19 @@ class DatabaseULog(ULog):
             data = {}
             if not lazy:
                 cur.execute('''
-                    SELECT TopicName, DataType, ValueArray
+                    SELECT TopicName,
+                           DataType,
+                           ValueArray,
+                           ValueArrayCompression,
+                           QuantScheme,
+                           QuantScale,
+                           QuantOffset
                     FROM ULogField
                     WHERE DatasetId = ?
                     ''', (dataset_id,))
-                field_results = cur.fetchall()
-                for field_name, data_type, value_bytes in field_results:
+                for field_name, data_type, *value_array in cur:
                     fields.append(DatabaseULog._FieldData(field_name=field_name,type_str=data_type))
-                    dtype = DatabaseULog._UNPACK_TYPES[data_type][2]
-                    data[field_name] = np.frombuffer(value_bytes, dtype=dtype)
+                    data[field_name] = DatabaseULog._decode_value_array(data_type, *value_array)
 
         # If caching=True but there is no existing dataset we could append a
         # new one to self._data_list, but that could be considered a
@@ -488,7 +606,145 @@ class DatabaseULog(ULog):
             )
         return dataset
 
-    def save(self, append_json=False):
+    @staticmethod
+    def _parse_flags(flags):
+        '''
+        Convert the CompatFlags or IncompatFlags column to a list of ints.
+        They are stored as BLOBs, but older rows store them as a TEXT string
+        with one character per flag byte.
+        '''
+        if isinstance(flags, str):
+            return [ord(c) for c in flags]
+        return list(flags)
+
+    @staticmethod
+    def _encode_value_array(values, compress=False, quantize=False):
+        '''
+        Convert a dataset array to the ULogField columns ValueArray,
+        ValueArrayCompression, QuantScheme, QuantScale and QuantOffset.
+
+        With quantize=True, floating point arrays are mapped linearly onto the
+        int16 range between their min and max values, and the scale and offset
+        needed to restore them are returned. Arrays with non-finite values are
+        left as they are, since int16 cannot represent them, and so are arrays
+        whose range is too small to give a positive normal scale.
+        '''
+        quant_scheme = quant_scale = quant_offset = None
+        if (quantize
+                and values.dtype.kind == 'f'
+                and len(values) > 0
+                and np.isfinite(values).all()):
+            min_value = float(values.min())
+            max_value = float(values.max())
+            # Halving first avoids overflow for values close to the float limits
+            scale = (max_value / 2 - min_value / 2) / 32767 if max_value > min_value else 1.0
+            if scale >= np.finfo(np.float64).tiny:
+                quant_scheme = 'int16'
+                quant_scale = scale
+                quant_offset = min_value / 2 + max_value / 2
+                values = np.rint((values.astype(np.float64) - quant_offset) / quant_scale)
+                values = values.astype(np.int16)
+
+        # sqlite3 binds buffer objects as BLOBs directly, so only arrays that
+        # are not contiguous in memory need a copy.
+        value_bytes = np.ascontiguousarray(values).data
+        if compress:
+            value_bytes = blosc.compress(value_bytes,
+                                         typesize=values.dtype.itemsize,
+                                         cname='lz4',
+                                         clevel=1)
+            compression = 'blosc'
+        else:
+            compression = None
+        return value_bytes, compression, quant_scheme, quant_scale, quant_offset
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _decode_value_array(data_type, value_bytes, compression=None,
+                            quant_scheme=None, quant_scale=None, quant_offset=None):
+        '''
+        Convert the ValueArray BLOB of a ULogField row back to a numpy array.
+        '''
+        if compression == 'blosc':
+            if blosc is None:
+                raise ImportError('The blosc package is needed to read compressed datasets.')
+            value_bytes = blosc.decompress(value_bytes)
+        elif compression is not None:
+            raise ValueError(f'Unknown ValueArray compression {compression}.')
+        dtype = DatabaseULog._NP_DTYPES[data_type]
+        if quant_scheme == 'int16':
+            quantized = np.frombuffer(value_bytes, dtype=np.int16)
+            return (quantized.astype(np.float64) * quant_scale + quant_offset).astype(dtype)
+        if quant_scheme is not None:
+            raise ValueError(f'Unknown ValueArray quantization {quant_scheme}.')
+        return np.frombuffer(value_bytes, dtype=dtype)
+
+    @staticmethod
+    def _json_keys(timestamps):
+        '''
+        Format the timestamps of a dataset as the JSON object key prefixes
+        used by _values_json. This only needs to be done once per dataset,
+        not once per field.
+
+        Returns the list of key prefixes and, if some timestamps are
+        duplicated, the indices of the values to keep for each key, since
+        duplicate timestamps keep the last value like a dict would.
+        '''
+        timestamp_list = timestamps.tolist()
+        key_indices = list(dict(zip(timestamp_list, range(len(timestamp_list)))).values())
+        if len(key_indices) == len(timestamp_list):
+            key_indices = None
+        else:
+            timestamp_list = [timestamp_list[index] for index in key_indices]
+        return [f'"{timestamp}": ' for timestamp in timestamp_list], key_indices
+
+    @staticmethod
+    def _values_json(json_keys, key_indices, values):
+        '''
+        Format a data series as a JSON object string mapping each timestamp to
+        its value, with non-finite values stored as null since JSON does not
+        support nan and inf. The keys are generated with _json_keys.
+
+        Precision is only good enough up to a few decimals, depending on the
+        default float formatter. The function np.array2string was tested, but
+        was slower. Also note that doing the slow json.dumps is unnecessary
+        since we know that the object to be formatted is an array, so the
+        string is built in a single pass instead.
+        '''
+        value_list = values.tolist()
+        if values.dtype.kind == 'f':
+            for index in np.flatnonzero(~np.isfinite(values)).tolist():
+                value_list[index] = 'null'
+        if key_indices is not None:
+            value_list = [value_list[index] for index in key_indices]
+        return '{' + ', '.join(map(operator.add, json_keys, map(str, value_list))) + '}'
+
+    def _field_rows(self, dataset_ids, append_json, compress, quantize):
+        '''
+        Yield the ULogField rows of all datasets one at a time, so that only
+        one encoded field is held in memory while they are inserted.
+        '''
+        for dataset, dataset_id in zip(self.data_list, dataset_ids):
+            if append_json:
+                json_keys, key_indices = DatabaseULog._json_keys(dataset.data['timestamp'])
+            for field in dataset.field_data:
+                values = dataset.data[field.field_name]
+                value_array = DatabaseULog._encode_value_array(values,
+                                                               compress=compress,
+                                                               quantize=quantize)
+                if append_json:
+                    values_json = DatabaseULog._values_json(json_keys, key_indices, values)
+                else:
+                    values_json = None
+                yield (
+                    field.field_name,
+                    field.type_str,
+                    *value_array,
+                    values_json,
+                    dataset_id,
+                )
+
+    def save(self, append_json=False, compress=False, quantize=False):
         '''
         Save the DatabaseULog to the database. Throws a KeyError if the primary
         key is already in the database.
@@ -497,10 +753,23 @@ class DatabaseULog(ULog):
         append_json=True, then datasets are additionally stored in a JSON
         field. This allows them to be directly queried using the sqlite
         function json_each, but increases the writing time and database size.
+
+        If compress=True, the BLOBs are compressed with blosc (LZ4, with byte
+        shuffling), which typically shrinks them several times and decompresses
+        faster than the bytes can be read. This requires the optional blosc
+        package, both for saving and for reading the datasets back.
+
+        If quantize=True, floating point datasets are stored as int16 values
+        scaled between their min and max, with a relative error of about
+        1/65534 of the value range. This is lossy, so it is only meant for
+        databases used for e.g. plotting, where the reduced size matters more
+        than full precision.
         '''
 
         if self._pk is not None:
             raise KeyError('Cannot save logs that are already in the database')
+        if compress and blosc is None:
+            raise ImportError('The blosc package is needed to save compressed datasets.')
 
         pk_from_hash = DatabaseULog.primary_key_from_sha256sum(self._db, self._sha256sum)
         if pk_from_hash is not None:
@@ -509,6 +778,9 @@ class DatabaseULog(ULog):
 
         with self._db() as con:
             cur = con.cursor()
+            # Write everything in one explicit transaction, which is committed
+            # (or rolled back) when leaving the connection context.
+            cur.execute('BEGIN IMMEDIATE')
 
             # ULog metadata
             cur.execute('''
@@ -520,8 +792,8 @@ class DatabaseULog(ULog):
                     self._file_version,
                     self._start_timestamp,
                     self._last_timestamp,
-                    ''.join([chr(n) for n in self._compat_flags]),
-                    ''.join([chr(n) for n in self._incompat_flags]),
+                    bytes(self._compat_flags),
+                    bytes(self._incompat_flags),
                     self._sync_seq_cnt,
                     self._has_sync,
                     self._sha256sum,
@@ -535,60 +807,36 @@ class DatabaseULog(ULog):
                 (SeriesIndex, Offset, ULogId)
                 VALUES
                 (?, ?, ?)
-                ''', [(
+                ''', ((
                     list_index,
                     offset,
                     self._pk,
-                ) for list_index, offset in enumerate(self._appended_offsets)])
+                ) for list_index, offset in enumerate(self._appended_offsets)))
 
             # data_list
-            for dataset in self.data_list:
-                cur.execute('''
-                    INSERT INTO ULogDataSet
-                    (DatasetName, MultiId, MessageId, TimestampIndex, ULogId)
-                    VALUES
-                    (?, ?, ?, ?, ?)
-                    ''', (
-                        dataset.name,
-                        dataset.multi_id,
-                        dataset.msg_id,
-                        dataset.timestamp_idx,
-                        self._pk,
-                    )
-                )
-                dataset_id = cur.lastrowid
-                for field in dataset.field_data:
-                    values = dataset.data[field.field_name]
-                    values_bytes = values.tobytes()
-                    if append_json:
-                        # Precision is only good enough up to a few decimals,
-                        # depending on the default float formatter. The
-                        # function np.array2string was tested, but was slower.
-                        # Also note that doing the slow json.dumps is also
-                        # unnecessary since we know that the object to be
-                        # formatted is an array.
-                        timestamp_list = [str(s) for s in dataset.data['timestamp'].tolist()]
-                        values_json = str(
-                            dict(zip(timestamp_list, values.tolist()))
-                        ).replace('nan', 'null').replace('inf', 'null').replace("'", '"')
-                        json_placeholder = 'json(?)'  # Saves some space
-                    else:
-                        values_json = None
-                        json_placeholder = '?'
-
-                    cur.execute(f'''
-                        INSERT INTO ULogField
-                        (TopicName, DataType, ValueArray, ValueJson, DatasetId)
-                        VALUES
-                        (?, ?, ?, {json_placeholder}, ?)
-                        ''', (
-                            field.field_name,
-                            field.type_str,
-                            values_bytes,
-                            values_json,
-                            dataset_id,
-                        )
-                    )
+            if append_json:
+                json_placeholder = 'json(?)'  # Saves some space
+            else:
+                json_placeholder = '?'
+            dataset_ids = DatabaseULog._insert_many(cur, '''
+                INSERT INTO ULogDataSet
+                (DatasetName, MultiId, MessageId, TimestampIndex, ULogId)
+                VALUES
+                (?, ?, ?, ?, ?)
+                ''', [(
+                    dataset.name,
+                    dataset.multi_id,
+                    dataset.msg_id,
+                    dataset.timestamp_idx,
+                    self._pk,
+                ) for dataset in self.data_list])
+            cur.executemany(f'''
+                INSERT INTO ULogField
+                (TopicName, DataType, ValueArray, ValueArrayCompression,
+                 QuantScheme, QuantScale, QuantOffset, ValueJson, DatasetId)
+                VALUES
+                (?, ?, ?, ?, ?, ?, ?, {json_placeholder}, ?)
+                ''', self._field_rows(dataset_ids, append_json, compress, quantize))
 
             # dropouts
             cur.executemany('''
@@ -596,11 +844,11 @@ class DatabaseULog(ULog):
                 (Timestamp, Duration, ULogId)
                 VALUES
                 (?, ?, ?)
-                ''', [(
+                ''', ((
                     dropout.timestamp,
                     dropout.duration,
                     self._pk,
-                ) for dropout in self._dropouts])
+                ) for dropout in self._dropouts))
 
             # logged_messages
             cur.executemany('''
@@ -608,12 +856,12 @@ class DatabaseULog(ULog):
                 (LogLevel, Timestamp, Message, ULogId)
                 VALUES
                 (?, ?, ?, ?)
-                ''', [(
+                ''', ((
                     message.log_level,
                     message.timestamp,
                     message.message,
                     self._pk,
-                ) for message in self._logged_messages])
+                ) for message in self._logged_messages))
 
             # logged_messages_tagged
             for tag, messages in self._logged_messages_tagged.items():
@@ -622,29 +870,31 @@ class DatabaseULog(ULog):
                     (LogLevel, Timestamp, Tag, Message, ULogId)
                     VALUES
                     (?, ?, ?, ?, ?)
-                    ''', [(
+                    ''', ((
                         message.log_level,
                         message.timestamp,
                         tag,
                         message.message,
                         self._pk,
-                    ) for message in messages])
+                    ) for message in messages))
 
             # message_formats
-            for name, message_format in self._message_formats.items():
-                cur.execute('''
-                    INSERT INTO ULogMessageFormat
-                    (Name, ULogId)
-                    VALUES
-                    (?, ?)
-                    ''', (name, self._pk))
-                format_id = cur.lastrowid
-                cur.executemany('''
-                    INSERT INTO ULogMessageFormatField
-                    (FieldType, ArraySize, Name, MessageId)
-                    VALUES
-                    (?, ?, ?, ?)
-                    ''', [(*field, format_id) for field in message_format.fields])
+            format_ids = DatabaseULog._insert_many(cur, '''
+                INSERT INTO ULogMessageFormat
+                (Name, ULogId)
+                VALUES
+                (?, ?)
+                ''', [(name, self._pk) for name in self._message_formats])
+            cur.executemany('''
+                INSERT INTO ULogMessageFormatField
+                (FieldType, ArraySize, Name, MessageId)
+                VALUES
+                (?, ?, ?, ?)
+                ''', (
+                    (*field, format_id)
+                    for message_format, format_id in zip(self._message_formats.values(), format_ids)
+                    for field in message_format.fields
+                ))
 
             # msg_info_dict
             cur.executemany('''
@@ -652,40 +902,46 @@ class DatabaseULog(ULog):
                 (Key, Value, Typename, ULogId)
                 VALUES
                 (?, ?, ?, ?)
-                ''', [(
+                ''', ((
                     key,
                     value,
                     self._msg_info_dict_types[key],
                     self._pk,
-                ) for key, value in self.msg_info_dict.items()])
+                ) for key, value in self.msg_info_dict.items()))
 
             # msg_info_multiple_dict
-            for key, lists in self.msg_info_multiple_dict.items():
-                cur.execute('''
-                    INSERT INTO ULogMessageInfoMultiple
-                    (Key, Typename, ULogId)
-                    VALUES
-                    (?, ?, ?)
-                    ''', (key, self._msg_info_multiple_dict_types[key], self._pk))
-                message_id = cur.lastrowid
-                for list_index, message_list in enumerate(lists):
-                    cur.execute('''
-                        INSERT INTO ULogMessageInfoMultipleList
-                        (SeriesIndex, MessageId)
-                        VALUES
-                        (?, ?)
-                        ''', (list_index, message_id))
-                    list_id = cur.lastrowid
-                    cur.executemany('''
-                        INSERT INTO ULogMessageInfoMultipleListElement
-                        (SeriesIndex, Value, ListId)
-                        VALUES
-                        (?, ?, ?)
-                        ''', [(
-                            series_index,
-                            value,
-                            list_id,
-                        ) for series_index, value in enumerate(message_list)])
+            message_ids = DatabaseULog._insert_many(cur, '''
+                INSERT INTO ULogMessageInfoMultiple
+                (Key, Typename, ULogId)
+                VALUES
+                (?, ?, ?)
+                ''', [(
+                    key,
+                    self._msg_info_multiple_dict_types[key],
+                    self._pk,
+                ) for key in self.msg_info_multiple_dict])
+            all_lists = [
+                (list_index, message_id, message_list)
+                for lists, message_id in zip(self.msg_info_multiple_dict.values(), message_ids)
+                for list_index, message_list in enumerate(lists)
+            ]
+            list_ids = DatabaseULog._insert_many(cur, '''
+                INSERT INTO ULogMessageInfoMultipleList
+                (SeriesIndex, MessageId)
+                VALUES
+                (?, ?)
+                ''', [(list_index, message_id) for list_index, message_id, _ in all_lists])
+            cur.executemany('''
+                INSERT INTO ULogMessageInfoMultipleListElement
+                (SeriesIndex, Value, ListId)
+                VALUES
+                (?, ?, ?)
+                ''', ((
+                    series_index,
+                    value,
+                    list_id,
+                ) for (_, _, message_list), list_id in zip(all_lists, list_ids)
+                  for series_index, value in enumerate(message_list)))
 
             # initial_parameters
             cur.executemany('''
@@ -693,11 +949,11 @@ class DatabaseULog(ULog):
                 (Key, Value, ULogId)
                 VALUES
                 (?, ?, ?)
-                ''', [(
+                ''', ((
                     key,
                     value,
                     self._pk,
-                ) for key, value in self.initial_parameters.items()])
+                ) for key, value in self.initial_parameters.items()))
 
             # _default_parameters
             for default_type, parameters in self._default_parameters.items():
@@ -706,12 +962,12 @@ class DatabaseULog(ULog):
                     (DefaultType, Key, Value, ULogId)
                     VALUES
                     (?, ?, ?, ?)
-                    ''', [(
+                    ''', ((
                         default_type,
                         key,
                         value,
                         self._pk,
-                    ) for key, value in parameters.items()])
+                    ) for key, value in parameters.items()))
 
             # changed_parameters
             cur.executemany('''
@@ -719,15 +975,32 @@ class DatabaseULog(ULog):
                 (Timestamp, Key, Value, ULogId)
                 VALUES
                 (?, ?, ?, ?)
-                ''', [(
+                ''', ((
                     timestamp,
                     key,
                     value,
                     self._pk,
-                ) for timestamp, key, value in self.changed_parameters])
+                ) for timestamp, key, value in self.changed_parameters))
 
             cur.close()
 
+    @staticmethod
+    def _insert_many(cur, sql, rows):
+        '''
+        Run an INSERT statement with executemany and return the list of row
+        ids that were assigned to the inserted rows, in order.
+
+        This relies on sqlite assigning contiguous ids to the rows inserted by
+        a single statement within a transaction, so that they can be derived
+        from last_insert_rowid() instead of inserting one row at a time.
+        '''
+        if not rows:
+            return []
+        cur.executemany(sql, rows)
+        cur.execute('SELECT last_insert_rowid()')
+        last_id, = cur.fetchone()
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
     def delete(self):
         '''
         Deletes the ULog row and cascading rows from the database.
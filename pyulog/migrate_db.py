@@ -59,6 +59,7 @@ def _read_db_schema_version(db_path, force):
         cur.execute('PRAGMA user_version')
         (db_schema_version,) = cur.fetchone()
         cur.close()
+    db_handle.close()
 
     if db_schema_version is None:
         raise ValueError(f'Could not fetch database schema version for {db_path}.')
@@ -128,6 +129,7 @@ def migrate_db(db_path, sql_dir=None, noop=False, force=False):
 
         cur.close()
         print('Migration done.')
+    db_handle.close()
     return db_path
 
 if __name__ == '__main__':
@@ -0,0 +1,4 @@
+BEGIN;
+-- NULL means that ValueArray holds the raw array bytes.
+ALTER TABLE ULogField ADD COLUMN ValueArrayCompression TEXT;
+COMMIT;
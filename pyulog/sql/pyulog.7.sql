@@ -0,0 +1,8 @@
+BEGIN;
+-- NULL means that ValueArray holds values of the field's own DataType.
+-- Otherwise the values are stored as QuantScheme integers q, and the
+-- original values are approximately q * QuantScale + QuantOffset.
+ALTER TABLE ULogField ADD COLUMN QuantScheme TEXT;
+ALTER TABLE ULogField ADD COLUMN QuantScale REAL;
+ALTER TABLE ULogField ADD COLUMN QuantOffset REAL;
+COMMIT;
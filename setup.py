@@ -51,6 +51,9 @@ setup(
         "numpy < 1.25; python_version < '3.9'",
         "numpy >= 1.25; python_version >= '3.9'",
     ],
+    extras_require={
+        'compression': ['blosc'],
+    },
     tests_require=['pytest', 'ddt'],
     entry_points = {
         'console_scripts': [
@@ -2,15 +2,17 @@
 Test the DatabaseULog module.
 '''
 
+import io
 import unittest
 import os
+import sqlite3
 import tempfile
 from unittest.mock import patch
 import numpy as np
 from ddt import ddt, data
 
 from pyulog import ULog
-from pyulog.db import DatabaseULog
+from pyulog.db import DatabaseULog, blosc
 from pyulog.migrate_db import migrate_db
 
 TEST_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -35,6 +37,7 @@ class TestDatabaseULog(unittest.TestCase):
         '''
         Remove the test database after use.
         '''
+        self.db_handle.close()
         os.remove(self.db_path)
 
     @data('sample_log_small',
@@ -109,6 +112,60 @@ class TestDatabaseULog(unittest.TestCase):
             self.assertIs(cache_miss, cache_hit)
             self.assertIsNot(cache_miss, uncached)
 
+    def test_text_flags(self):
+        '''
+        Verify that compat and incompat flags stored as TEXT by older versions
+        are still read correctly.
+        '''
+        test_file = os.path.join(TEST_PATH, 'sample_appended.ulg')
+        dbulog_saved = DatabaseULog(self.db_handle, log_file=test_file)
+        dbulog_saved.save()
+        with self.db_handle() as con:
+            con.execute('''
+                UPDATE ULog
+                SET CompatFlags = ?, IncompatFlags = ?
+                WHERE Id = ?
+            ''', (
+                ''.join([chr(n) for n in dbulog_saved._compat_flags]),  # pylint: disable=protected-access
+                ''.join([chr(n) for n in dbulog_saved._incompat_flags]),  # pylint: disable=protected-access
+                dbulog_saved.primary_key,
+            ))
+        dbulog_loaded = DatabaseULog(self.db_handle, primary_key=dbulog_saved.primary_key)
+        self.assertEqual(dbulog_loaded._compat_flags, dbulog_saved._compat_flags)  # pylint: disable=protected-access
+        self.assertEqual(dbulog_loaded._incompat_flags, dbulog_saved._incompat_flags)  # pylint: disable=protected-access
+
+    def test_load_twice(self):
+        '''
+        Verify that calling load() again does not duplicate the lists of
+        multiple info messages.
+        '''
+        test_file = os.path.join(TEST_PATH, 'sample_appended_multiple.ulg')
+        ulog = ULog(test_file)
+        dbulog_saved = DatabaseULog(self.db_handle, log_file=test_file)
+        dbulog_saved.save()
+        dbulog_loaded = DatabaseULog(self.db_handle,
+                                     primary_key=dbulog_saved.primary_key,
+                                     lazy=False)
+        dbulog_loaded.load(lazy=False)
+        self.assertEqual(ulog.msg_info_multiple_dict, dbulog_loaded.msg_info_multiple_dict)
+
+    def test_closed_connection(self):
+        '''
+        Verify that the handle opens a new connection if a caller closed the
+        shared one.
+        '''
+        self.db_handle().close()
+        log_path = os.path.join(TEST_PATH, 'sample_log_small.ulg')
+        dbulog = DatabaseULog(self.db_handle, log_file=log_path)
+        dbulog.save()
+        self.assertTrue(DatabaseULog.exists_in_db(self.db_handle, dbulog.primary_key))
+
+        con = self.db_handle()
+        self.db_handle.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            con.cursor()
+        self.assertIsNot(self.db_handle(), con)
+
     def test_save(self):
         '''
         Test that save() twice raises an error, since we currently do not
@@ -156,6 +213,23 @@ class TestDatabaseULog(unittest.TestCase):
         open_digest = DatabaseULog.calc_sha256sum(test_file_handle)
         self.assertEqual(digest, open_digest)
 
+        test_file_handle.seek(100)
+        offset_digest = DatabaseULog.calc_sha256sum(test_file_handle)
+        with open(test_file, 'rb') as bytes_file:
+            bytes_handle = io.BytesIO(bytes_file.read())
+        bytes_handle.seek(100)
+        self.assertEqual(offset_digest, DatabaseULog.calc_sha256sum(bytes_handle))
+        self.assertNotEqual(digest, offset_digest)
+
+        class ReadOnlyFile:
+            ''' File-like object that only provides read() and closed. '''
+            def __init__(self, file_handle):
+                self.closed = False
+                self.read = file_handle.read
+        with open(test_file, 'rb') as read_only_handle:
+            read_only_digest = DatabaseULog.calc_sha256sum(ReadOnlyFile(read_only_handle))
+        self.assertEqual(digest, read_only_digest)
+
         test_file_handle.close()
         closed_digest = DatabaseULog.calc_sha256sum(test_file_handle)
         self.assertEqual(digest, closed_digest)
@@ -197,6 +271,96 @@ class TestDatabaseULog(unittest.TestCase):
         dbulog.delete()
         self.assertEqual(db_size(), initial_size)
 
+    @unittest.skipIf(blosc is None, 'blosc is not installed')
+    @data('sample_log_small',
+          'sample_appended')
+    def test_compression(self, test_case):
+        '''
+        Verify that datasets saved with compress=True are read back unchanged,
+        and that they take less space than uncompressed datasets.
+        '''
+        test_file = os.path.join(TEST_PATH, f'{test_case}.ulg')
+
+        ulog = ULog(test_file)
+        dbulog_saved = DatabaseULog(self.db_handle, log_file=test_file)
+        dbulog_saved.save(compress=True)
+        dbulog_loaded = DatabaseULog(self.db_handle,
+                                     primary_key=dbulog_saved.primary_key,
+                                     lazy=False)
+        self.assertEqual(ulog, dbulog_loaded)
+        for dataset in ulog.data_list:
+            self.assertEqual(dataset, dbulog_loaded.get_dataset(dataset.name,
+                                                                multi_instance=dataset.multi_id,
+                                                                caching=False))
+
+        with self.db_handle() as con:
+            cur = con.cursor()
+            cur.execute('''
+                SELECT SUM(LENGTH(uf.ValueArray))
+                FROM ULogField uf JOIN ULogDataset uds ON uf.DatasetId = uds.Id
+                WHERE uds.ULogId = ?
+                ''', (dbulog_saved.primary_key,))
+            compressed_size, = cur.fetchone()
+            cur.close()
+        raw_size = sum(values.nbytes
+                       for dataset in ulog.data_list
+                       for values in dataset.data.values())
+        self.assertLess(compressed_size, raw_size)
+
+        with patch('pyulog.db.blosc', None):
+            with self.assertRaises(ImportError):
+                _ = DatabaseULog(self.db_handle,
+                                 primary_key=dbulog_saved.primary_key,
+                                 lazy=False)
+
+    def test_compression_without_blosc(self):
+        '''
+        Verify that save(compress=True) raises an error if blosc is missing.
+        '''
+        log_path = os.path.join(TEST_PATH, 'sample_log_small.ulg')
+        dbulog = DatabaseULog(self.db_handle, log_file=log_path)
+        with patch('pyulog.db.blosc', None):
+            with self.assertRaises(ImportError):
+                dbulog.save(compress=True)
+        self.assertIsNone(dbulog.primary_key)
+
+    def test_quantize(self):
+        '''
+        Verify that datasets saved with quantize=True are read back with the
+        original types, exactly for integer fields and within the quantization
+        step for float fields.
+        '''
+        test_file = os.path.join(TEST_PATH, 'sample_log_small.ulg')
+
+        ulog = ULog(test_file)
+        dbulog_saved = DatabaseULog(self.db_handle, log_file=test_file)
+        dbulog_saved.save(quantize=True)
+        dbulog_loaded = DatabaseULog(self.db_handle,
+                                     primary_key=dbulog_saved.primary_key,
+                                     lazy=False)
+        for dataset in ulog.data_list:
+            db_dataset = dbulog_loaded.get_dataset(dataset.name,
+                                                   multi_instance=dataset.multi_id)
+            for field_name, values in dataset.data.items():
+                db_values = db_dataset.data[field_name]
+                self.assertEqual(db_values.dtype, values.dtype)
+                if values.dtype.kind == 'f' and np.isfinite(values).all():
+                    # Half a quantization step, plus rounding to the dtype
+                    atol = ((values.max() - values.min()) / 65534 / 2
+                            + np.finfo(values.dtype).eps * np.abs(values).max())
+                    np.testing.assert_allclose(db_values, values, rtol=0, atol=atol)
+                else:
+                    np.testing.assert_array_equal(db_values, values)
+
+        # A range too small for a non-zero scale is stored unquantized
+        values = np.array([0.0, 5e-324])
+        with np.errstate(all='raise'):
+            value_array = DatabaseULog._encode_value_array(values, quantize=True)  # pylint: disable=protected-access
+        self.assertIsNone(value_array[2])
+        db_values = DatabaseULog._decode_value_array(  # pylint: disable=protected-access
+            'double', bytes(value_array[0]), *value_array[1:])
+        np.testing.assert_array_equal(db_values, values)
+
     def test_json(self):
         '''
         Verify that the storage of JSON rows allows for reproduction of the
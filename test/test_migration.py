@@ -42,6 +42,7 @@ class TestMigration(unittest.TestCase):
             filepath = os.path.join(self.sql_dir, filename)
             os.remove(filepath)
         os.rmdir(self.sql_dir)
+        self.db_handle.close()
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
 
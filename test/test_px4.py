@@ -35,6 +35,7 @@ class TestPX4ULog(unittest.TestCase):
         '''
         Remove the test database after use.
         '''
+        self.db_handle.close()
         os.remove(self.db_path)
 
     @data('sample',